@@ -8,7 +8,14 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 from mfrc522 import SimpleMFRC522
 import RPi.GPIO as GPIO
+import atexit
+import collections
 import hashlib
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
 import time
 import signal
 import sys
@@ -18,6 +25,46 @@ YELLOW_LED_PIN = 17  # GPIO17
 RED_LED_PIN = 27     # GPIO27
 BUZZER_PIN = 22      # GPIO22
 
+# LED/buzzer pulses are played by a background thread; extra requests are dropped
+FeedbackAction = collections.namedtuple('FeedbackAction', ['pin', 'duration', 'pause'])
+FEEDBACK_QUEUE_SIZE = 16
+
+# Repeated reads of a card held on the reader within this window count as one tap
+RFID_REPEAT_WINDOW = 1.0
+
+# Firestore allows at most 500 writes per batch
+FIREBASE_BATCH_LIMIT = 500
+
+# Camera Configuration
+FRAME_SAMPLE_INTERVAL = 0.3  # Seconds between processed frames (~3 FPS)
+# Optional GStreamer pipeline for Pi camera modules (1-frame latency), e.g.
+# "v4l2src device=/dev/video0 ! video/x-raw,width=640,height=480 ! videoconvert ! appsink drop=1 max-buffers=1"
+CAMERA_PIPELINE = None
+DETECTION_SCALE = 4  # Downscale factor for the DNN detector and the motion pre-filter
+HOG_DETECTION_SCALE = 2  # HOG's 80x80 window needs more pixels: finds faces from ~160 px
+# OpenCV DNN (SSD) face detector; HOG is used when these files are missing
+FACE_DNN_PROTOTXT = 'data/data_opencv/deploy.prototxt'
+FACE_DNN_MODEL = 'data/data_opencv/res10_300x300_ssd_iter_140000.caffemodel'
+FACE_DNN_CONFIDENCE = 0.5
+# Idle handling in verify_face: back off while no face is seen, skip detection on static scenes
+IDLE_BACKOFF_STEP = 0.05  # Extra seconds between samples per consecutive empty frame
+MAX_IDLE_BACKOFF = 0.5
+MOTION_PIXEL_THRESHOLD = 25  # Per-pixel difference counted as motion
+MOTION_MIN_PIXELS = 50       # Changed pixels (on the downscaled frame) needed to run detection
+DEBUG_PREVIEW = True  # Show the verification preview window when a display is available
+PREVIEW_EVERY_N_FRAMES = 5
+
+# Stay well below SQLite's bound-parameter limit in IN (...) lookups
+SQL_IN_BATCH = 500
+
+# Frames discarded before verifying each student, so the first processed frame is current
+CAMERA_FLUSH_FRAMES = 3
+# Vision worker task asking it to release the camera at the end of a verification pass
+RELEASE_CAMERA = 'release_camera'
+
+# Seconds to wait for the vision worker's result (verify_face itself gives up after 30)
+VERIFY_RESULT_TIMEOUT = 45
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -33,6 +80,50 @@ GPIO.setup(YELLOW_LED_PIN, GPIO.OUT)
 GPIO.setup(RED_LED_PIN, GPIO.OUT)
 GPIO.setup(BUZZER_PIN, GPIO.OUT)
 
+# Face models shared by every IntegratedAttendanceSystem instance, loaded on first use
+_MODELS = {}
+
+def _load_fast_detector():
+    """Load the OpenCV DNN face detector, or return None to fall back to HOG"""
+    if not (os.path.exists(FACE_DNN_PROTOTXT) and os.path.exists(FACE_DNN_MODEL)):
+        logging.info("DNN face detector model not found, using HOG detector")
+        return None
+    
+    try:
+        net = cv2.dnn.readNetFromCaffe(FACE_DNN_PROTOTXT, FACE_DNN_MODEL)
+    except cv2.error as e:
+        logging.warning(f"Failed to load DNN face detector, using HOG detector: {e}")
+        return None
+    
+    logging.info("Using DNN face detector")
+    return net
+
+def _lazy_load():
+    """Load the face models once per process and return the shared cache"""
+    if not _MODELS:
+        models = {
+            'detector': dlib.get_frontal_face_detector(),
+            'fast_detector': _load_fast_detector(),
+            'predictor': dlib.shape_predictor('data/data_dlib/shape_predictor_68_face_landmarks.dat'),
+            'face_reco_model': dlib.face_recognition_model_v1('data/data_dlib/dlib_face_recognition_resnet_model_v1.dat')
+        }
+        # Only cache a complete set, so a failed load is retried next time
+        _MODELS.update(models)
+    return _MODELS
+
+# Vision worker shared by every instance. It is forked once, by the first instance,
+# before any Firebase/SQLite connection exists; later instances reuse it.
+_VISION = {}
+
+def _stop_vision_worker():
+    """Stop the shared vision worker at interpreter exit"""
+    if _VISION and _VISION['process'].is_alive():
+        _VISION['tasks'].put(None)
+        _VISION['process'].join(timeout=5)
+
+class VisionWorkerError(RuntimeError):
+    """The vision worker process has stopped, so faces can no longer be verified"""
+
 class IntegratedAttendanceSystem:
     def __init__(self):
         try:
@@ -42,6 +133,27 @@ class IntegratedAttendanceSystem:
             # Initialize RFID reader
             self.reader = SimpleMFRC522()
             
+            # Face recognition setup
+            self.check_dlib_build()
+            models = _lazy_load()
+            self.detector = models['detector']
+            self.fast_detector = models['fast_detector']
+            self.predictor = models['predictor']
+            self.face_reco_model = models['face_reco_model']
+            # Run the detector once so first-call initialization stays out of the capture loop
+            self.detector(np.zeros((64, 64), dtype=np.uint8), 0)
+            
+            # Verification preview and early stop
+            self.show_preview = bool(os.environ.get("DISPLAY")) and DEBUG_PREVIEW
+            self._stop_event = threading.Event()
+            
+            # Camera kept open by the vision worker for a whole verification pass
+            self._cap = None
+            
+            # Fork the vision worker (first instance only) before Firebase/SQLite connections exist
+            self.start_vision_worker()
+            self.start_feedback_thread()
+            
             # Initialize Firebase
             if not firebase_admin._apps:
                 cred = credentials.Certificate("serviceAccountKey.json")
@@ -49,13 +161,15 @@ class IntegratedAttendanceSystem:
             self.db = firestore.client()
             
             # Initialize local database
+            self.conn = sqlite3.connect("attendance.db", check_same_thread=False, isolation_level=None)
+            self.conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA cache_size=-20000;
+            """)
             self.init_local_db()
             
-            # Face recognition setup
-            self.detector = dlib.get_frontal_face_detector()
-            self.predictor = dlib.shape_predictor('data/data_dlib/shape_predictor_68_face_landmarks.dat')
-            self.face_reco_model = dlib.face_recognition_model_v1('data/data_dlib/dlib_face_recognition_resnet_model_v1.dat')
-            
             # Session and temporary attendance management
             self.current_session = None
             self.temp_attendance = {}
@@ -63,6 +177,21 @@ class IntegratedAttendanceSystem:
             self.persistent_rfid_attendance = {}
             self.new_rfid_attendance = {}
             
+            # In-memory RFID lookup, refreshed on registration
+            self._rfid_index = {}
+            self.load_rfid_index()
+            
+            # Firestore writes queued until the end of a verification pass
+            self._pending_firebase = []
+            
+            # Per-student data used by verification, keyed by unique_id
+            self._descriptor_cache = {}
+            self._rfid_cache = {}
+            
+            # Last card seen, to ignore a card left on the reader
+            self._last_rfid = None
+            self._last_rfid_time = 0
+            
             logging.info("Integrated Attendance System initialized successfully")
         except Exception as e:
             logging.error(f"Initialization error: {e}")
@@ -74,23 +203,43 @@ class IntegratedAttendanceSystem:
         GPIO.output(RED_LED_PIN, GPIO.LOW)
         GPIO.output(BUZZER_PIN, GPIO.LOW)
 
+    def start_feedback_thread(self):
+        """Start the thread that plays queued LED/buzzer pulses"""
+        self._feedback_q = queue.Queue(maxsize=FEEDBACK_QUEUE_SIZE)
+        self._feedback_thread = threading.Thread(target=self.feedback_loop, name='feedback', daemon=True)
+        self._feedback_thread.start()
+
+    def feedback_loop(self):
+        """Play queued feedback actions until told to stop"""
+        while True:
+            action = self._feedback_q.get()
+            if action is None:
+                break
+            
+            GPIO.output(action.pin, GPIO.HIGH)
+            time.sleep(action.duration)
+            GPIO.output(action.pin, GPIO.LOW)
+            time.sleep(action.pause)
+
+    def queue_feedback(self, pin, duration, pause=0):
+        """Queue a pulse on a pin without blocking the caller"""
+        try:
+            self._feedback_q.put_nowait(FeedbackAction(pin, duration, pause))
+        except queue.Full:
+            pass  # Dropping feedback is better than stalling RFID handling
+
     def single_beep(self, duration=0.1):
         """Generate a single beep"""
-        GPIO.output(BUZZER_PIN, GPIO.HIGH)
-        time.sleep(duration)
-        GPIO.output(BUZZER_PIN, GPIO.LOW)
+        self.queue_feedback(BUZZER_PIN, duration)
 
     def multiple_beeps(self, count=3, duration=0.1, interval=0.1):
         """Generate multiple beeps"""
         for _ in range(count):
-            self.single_beep(duration)
-            time.sleep(interval)
+            self.queue_feedback(BUZZER_PIN, duration, interval)
 
     def blink_led(self, led_pin, duration=0.5):
         """Blink specified LED"""
-        GPIO.output(led_pin, GPIO.HIGH)
-        time.sleep(duration)
-        GPIO.output(led_pin, GPIO.LOW)
+        self.queue_feedback(led_pin, duration)
 
     def both_leds_on(self):
         """Turn on both LEDs"""
@@ -102,11 +251,114 @@ class IntegratedAttendanceSystem:
         GPIO.output(YELLOW_LED_PIN, GPIO.LOW)
         GPIO.output(RED_LED_PIN, GPIO.LOW)
 
+    def check_dlib_build(self):
+        """Log dlib's SIMD/BLAS build flags so a slow (non-NEON/BLAS) build is caught at startup
+
+        Build dlib with OpenBLAS installed (libopenblas-dev) and:
+        python3 setup.py install --compiler-flags "-O3 -mfpu=neon -mfloat-abi=hard -march=native -ftree-vectorize"
+        """
+        use_blas = getattr(dlib, 'DLIB_USE_BLAS', False)
+        use_neon = getattr(dlib, 'USE_NEON_INSTRUCTIONS', False)
+        use_avx = getattr(dlib, 'USE_AVX_INSTRUCTIONS', False)
+        logging.info(f"dlib {dlib.__version__} build: BLAS={use_blas}, NEON={use_neon}, AVX={use_avx}")
+        if not use_blas or not use_neon:
+            logging.warning("dlib was built without BLAS/NEON; face detection and descriptors will be slow")
+
+    def start_vision_worker(self):
+        """Attach to the shared process that runs camera capture and face verification
+
+        The worker runs on the forked copy of the instance that started it; it only uses
+        the shared models and camera settings, which are the same for every instance.
+        """
+        if not _VISION:
+            # fork shares the already-loaded dlib models with the child instead of reloading them
+            ctx = mp.get_context('fork')
+            tasks = ctx.Queue()
+            results = ctx.Queue()
+            process = ctx.Process(
+                target=self.vision_worker_loop,
+                args=(tasks, results),
+                name='vision-worker',
+                daemon=True
+            )
+            process.start()
+            _VISION.update(tasks=tasks, results=results, task_ids=itertools.count(), process=process)
+            atexit.register(_stop_vision_worker)
+        elif not _VISION['process'].is_alive():
+            # Forking again would copy the previous instance's live gRPC state
+            raise VisionWorkerError(f"Vision worker exited with code {_VISION['process'].exitcode}")
+        
+        self._vision_tasks = _VISION['tasks']
+        self._vision_results = _VISION['results']
+        self._vision_task_ids = _VISION['task_ids']
+        self._vision_worker = _VISION['process']
+
+    def vision_worker_loop(self, tasks, results):
+        """Vision worker: verify faces for queued descriptor matrices until told to stop"""
+        signal.signal(signal.SIGINT, self.handle_worker_signal)
+        signal.signal(signal.SIGTERM, self.handle_worker_signal)
+        
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if task == RELEASE_CAMERA:
+                self.release_camera()
+                continue
+            
+            self._stop_event.clear()
+            task_id, descriptor_bytes = task
+            try:
+                stored_descriptors = np.frombuffer(descriptor_bytes, dtype=np.float32).reshape(-1, 128)
+                face_verified = self.verify_face(stored_descriptors)
+            except Exception as e:
+                logging.error(f"Vision worker error: {e}")
+                face_verified = False
+            
+            results.put((task_id, face_verified))
+
+    def handle_worker_signal(self, signum, frame):
+        """Abort the current verification on SIGINT; SIGTERM also stops the worker"""
+        self._stop_event.set()
+        if signum == signal.SIGTERM:
+            sys.exit(0)
+
+    def release_camera(self):
+        """Release the camera held across verify_face calls"""
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+            if self.show_preview:
+                cv2.destroyAllWindows()
+
+    def request_face_verification(self, face_descriptors):
+        """Verify a face in the vision worker, handling RFID taps while waiting"""
+        task_id = next(self._vision_task_ids)
+        self._vision_tasks.put((task_id, face_descriptors.tobytes()))
+        
+        deadline = time.time() + VERIFY_RESULT_TIMEOUT
+        while time.time() < deadline:
+            try:
+                result_id, face_verified = self._vision_results.get(timeout=0.1)
+            except queue.Empty:
+                if not self._vision_worker.is_alive():
+                    # Re-forking now would copy live Firebase/gRPC state, so stop instead
+                    raise VisionWorkerError(
+                        f"Vision worker exited with code {self._vision_worker.exitcode}")
+                self.poll_rfid_tap()
+                continue
+            
+            if result_id == task_id:
+                return face_verified
+            # Result of an earlier request that was abandoned; discard it
+        
+        logging.error("Timed out waiting for face verification result")
+        return False
+
     def init_local_db(self):
         """Initialize the local SQLite database"""
         try:
-            conn = sqlite3.connect("attendance.db")
-            cursor = conn.cursor()
+            cursor = self.conn.cursor()
             
             cursor.execute('''CREATE TABLE IF NOT EXISTS students
                           (unique_id TEXT PRIMARY KEY, 
@@ -130,57 +382,195 @@ class IntegratedAttendanceSystem:
                            face_time TEXT,
                            status TEXT)''')
             
-            conn.commit()
-            conn.close()
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_attn_unique ON attendance_log(unique_id, session_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_attn_date ON attendance_log(date)")
+            
+            self.migrate_face_descriptors()
             logging.info("Database initialized successfully")
             
         except sqlite3.Error as e:
             logging.error(f"Database initialization error: {e}")
             raise
 
+    def migrate_face_descriptors(self):
+        """Convert legacy float64 face descriptor BLOBs to float32 (schema version 1)"""
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= 1:
+            return
+        
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("SELECT unique_id, face_descriptors FROM students WHERE face_descriptors IS NOT NULL")
+            rows = [(np.frombuffer(blob, dtype=np.float64).astype(np.float32).tobytes(), unique_id)
+                    for unique_id, blob in cursor.fetchall()]
+            cursor.executemany("UPDATE students SET face_descriptors=? WHERE unique_id=?", rows)
+            cursor.execute("PRAGMA user_version = 1")
+            cursor.execute("COMMIT")
+        except Exception:
+            # Also covers a malformed BLOB rejected by np.frombuffer
+            cursor.execute("ROLLBACK")
+            raise
+        
+        if rows:
+            logging.info(f"Migrated face descriptors for {len(rows)} students to float32")
+
+    def load_rfid_index(self):
+        """Load the RFID -> (role, record) mapping for all students and lecturers"""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT rfid_id, unique_id, name, NULL, NULL, 'student' FROM students
+            UNION ALL
+            SELECT rfid_id, unique_id, name, course_name, course_code, 'lecturer' FROM lecturers
+        """)
+        
+        self._rfid_index = {}
+        for rfid_id, unique_id, name, course_name, course_code, role in cursor.fetchall():
+            if role == 'lecturer':
+                self._rfid_index[str(rfid_id)] = (role, (unique_id, name, course_name, course_code))
+            else:
+                self._rfid_index[str(rfid_id)] = (role, (unique_id, name))
+        
+        logging.info(f"Loaded {len(self._rfid_index)} RFID records")
+
     def generate_unique_id(self, name):
         """Generate a consistent unique ID for a student or lecturer"""
-        return hashlib.sha256(name.encode()).hexdigest()[:16]
+        return hashlib.blake2s(name.encode('utf-8'), digest_size=8).hexdigest()
 
     def is_rfid_registered(self, rfid_id):
         """Check if an RFID is already registered"""
-        conn = sqlite3.connect("attendance.db")
-        cursor = conn.cursor()
+        if str(rfid_id) in self._rfid_index:
+            return True
         
-        cursor.execute("SELECT rfid_id FROM students WHERE rfid_id=?", (str(rfid_id),))
-        student_rfid = cursor.fetchone()
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT EXISTS(SELECT 1 FROM students WHERE rfid_id=?
+                          UNION ALL
+                          SELECT 1 FROM lecturers WHERE rfid_id=?)
+        """, (str(rfid_id), str(rfid_id)))
         
-        cursor.execute("SELECT rfid_id FROM lecturers WHERE rfid_id=?", (str(rfid_id),))
-        lecturer_rfid = cursor.fetchone()
+        return bool(cursor.fetchone()[0])
+
+    def open_camera(self):
+        """Open the camera with a minimal frame buffer so processed frames are fresh"""
+        self.camera_yuyv = False
         
-        conn.close()
+        if CAMERA_PIPELINE:
+            cap = cv2.VideoCapture(CAMERA_PIPELINE, cv2.CAP_GSTREAMER)
+            if cap.isOpened():
+                return cap
+            logging.warning("GStreamer camera pipeline failed to open, falling back to V4L2")
         
-        return student_rfid is not None or lecturer_rfid is not None
-
-    def capture_face_sample(self, name, timeout=30):
-        """Capture a single face sample with robust error handling"""
         cap = cv2.VideoCapture(0)
+        if not cap.set(cv2.CAP_PROP_BUFFERSIZE, 1):
+            # The grab() loop in the capture functions still drains stale frames between samples
+            logging.warning("Failed to reduce capture buffer")
+        
+        # Prefer raw YUYV so the detector can use the Y plane directly; otherwise MJPG
+        yuyv = cv2.VideoWriter_fourcc(*'YUYV')
+        if (cap.set(cv2.CAP_PROP_FOURCC, yuyv) and int(cap.get(cv2.CAP_PROP_FOURCC)) == yuyv
+                and cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)):
+            self.camera_yuyv = True
+        else:
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        
         cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        self.camera_size = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        return cap
+
+    def frame_to_bgr(self, frame):
+        """Return a BGR image for a retrieved frame, converting raw YUYV if needed"""
+        if not self.camera_yuyv:
+            return frame
+        return cv2.cvtColor(frame.reshape(*self.camera_size, 2), cv2.COLOR_YUV2BGR_YUYV)
+
+    def downscale_frame(self, frame, scale=DETECTION_SCALE):
+        """Downscale a retrieved frame for detection (grayscale for YUYV, BGR otherwise)"""
+        if self.camera_yuyv:
+            # The Y plane of a YUYV frame is already grayscale
+            image = frame.reshape(*self.camera_size, 2)[:, :, 0]
+        else:
+            image = frame
+        return cv2.resize(image, (0, 0), fx=1.0 / scale, fy=1.0 / scale)
+
+    def has_motion(self, prev_gray_small, gray_small):
+        """Check whether two downscaled grayscale frames differ enough to be worth detecting on"""
+        diff = cv2.absdiff(prev_gray_small, gray_small)
+        _, mask = cv2.threshold(diff, MOTION_PIXEL_THRESHOLD, 255, cv2.THRESH_BINARY)
+        return cv2.countNonZero(mask) >= MOTION_MIN_PIXELS
+
+    def detect_faces(self, frame, small=None):
+        """Detect faces on a downscaled frame and return rectangles in full-resolution coordinates
+
+        `small` is an optional DETECTION_SCALE frame already computed by the caller; HOG
+        runs on its own HOG_DETECTION_SCALE frame instead.
+        """
+        if self.fast_detector is not None:
+            scale = DETECTION_SCALE
+            if small is None:
+                small = self.downscale_frame(frame, scale)
+            faces = self.detect_faces_dnn(small)
+        else:
+            scale = HOG_DETECTION_SCALE
+            hog_small = self.downscale_frame(frame, scale)
+            gray_small = hog_small if self.camera_yuyv else cv2.cvtColor(hog_small, cv2.COLOR_BGR2GRAY)
+            faces = self.detector(gray_small, 0)
+        
+        return [dlib.rectangle(face.left() * scale,
+                               face.top() * scale,
+                               face.right() * scale,
+                               face.bottom() * scale)
+                for face in faces]
+
+    def detect_faces_dnn(self, small):
+        """Run the SSD face detector, returning dlib rectangles ordered by confidence"""
+        if small.ndim == 2:
+            small = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+        h, w = small.shape[:2]
+        
+        blob = cv2.dnn.blobFromImage(small, 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.fast_detector.setInput(blob)
+        dets = self.fast_detector.forward()[0, 0]
+        
+        boxes = dets[dets[:, 2] >= FACE_DNN_CONFIDENCE, 3:7] * np.array([w, h, w, h])
+        boxes = np.clip(boxes, 0, [w - 1, h - 1, w - 1, h - 1]).astype(int)
+        return [dlib.rectangle(*box) for box in boxes.tolist()]
+
+    def capture_face_sample(self, name, timeout=30):
+        """Capture a single face sample with robust error handling"""
+        cap = self.open_camera()
         
         print(f"Capturing face for {name}. Look directly at the camera. Press 'q' to exit.")
         
         start_time = time.time()
+        last_proc = 0
         face_descriptor = None
         
         while time.time() - start_time < timeout:
-            ret, frame = cap.read()
+            # Grab every frame to keep the stream current, but only decode sampled ones
+            if not cap.grab():
+                print("Failed to capture frame. Retrying...")
+                time.sleep(0.1)
+                continue
+            
+            if time.time() - last_proc <= FRAME_SAMPLE_INTERVAL:
+                continue
+            
+            ret, frame = cap.retrieve()
             if not ret:
                 print("Failed to capture frame. Retrying...")
                 time.sleep(0.1)
                 continue
+            last_proc = time.time()
             
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.detector(gray, 0)
+            faces = self.detect_faces(frame)
             
             if faces:
+                frame = self.frame_to_bgr(frame)
                 face = faces[0]
-                shape = self.predictor(gray, face)
+                shape = self.predictor(frame, face)
                 face_descriptor = self.face_reco_model.compute_face_descriptor(frame, shape)
                 face_descriptor = np.array(face_descriptor)
                 
@@ -193,7 +583,7 @@ class IntegratedAttendanceSystem:
                 
                 break
             
-            cv2.imshow('Face Registration', frame)
+            cv2.imshow('Face Registration', self.frame_to_bgr(frame))
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
         
@@ -245,10 +635,9 @@ class IntegratedAttendanceSystem:
                 self.blink_led(RED_LED_PIN, 1.0)  # Error feedback
                 return None
             
-            conn = sqlite3.connect("attendance.db")
-            cursor = conn.cursor()
+            cursor = self.conn.cursor()
             
-            serialized_descriptors = np.array(face_descriptors).tobytes()
+            serialized_descriptors = np.asarray(face_descriptors, dtype=np.float32).tobytes()
             
             try:
                 cursor.execute("""
@@ -257,7 +646,7 @@ class IntegratedAttendanceSystem:
                     VALUES (?, ?, ?, ?)
                 """, (unique_id, name, str(rfid_id), serialized_descriptors))
                 
-                conn.commit()
+                self._rfid_index[str(rfid_id)] = ('student', (unique_id, name))
                 print(f"Successfully registered student: {name}")
                 self.blink_led(YELLOW_LED_PIN, 1.0)  # Success feedback
                 self.single_beep(0.2)
@@ -268,9 +657,6 @@ class IntegratedAttendanceSystem:
                 self.blink_led(RED_LED_PIN, 1.0)  # Error feedback
                 return None
             
-            finally:
-                conn.close()
-            
         except Exception as e:
             logging.error(f"Student registration error: {e}")
             self.blink_led(RED_LED_PIN, 1.0)  # Error feedback
@@ -292,8 +678,7 @@ class IntegratedAttendanceSystem:
             course_code = input("Enter course code: ")
             unique_id = self.generate_unique_id(name)
             
-            conn = sqlite3.connect("attendance.db")
-            cursor = conn.cursor()
+            cursor = self.conn.cursor()
             
             try:
                 cursor.execute("""
@@ -302,7 +687,7 @@ class IntegratedAttendanceSystem:
                     VALUES (?, ?, ?, ?, ?)
                 """, (unique_id, name, str(rfid_id), course_name, course_code))
                 
-                conn.commit()
+                self._rfid_index[str(rfid_id)] = ('lecturer', (unique_id, name, course_name, course_code))
                 print(f"Successfully registered lecturer: {name}")
                 self.blink_led(YELLOW_LED_PIN, 1.0)  # Success feedback
                 self.multiple_beeps(2, 0.2, 0.1)  # Double beep for lecturer
@@ -313,9 +698,6 @@ class IntegratedAttendanceSystem:
                 self.blink_led(RED_LED_PIN, 1.0)  # Error feedback
                 return None
             
-            finally:
-                conn.close()
-            
         except Exception as e:
             logging.error(f"Lecturer registration error: {e}")
             self.blink_led(RED_LED_PIN, 1.0)  # Error feedback
@@ -329,17 +711,14 @@ class IntegratedAttendanceSystem:
             
             while True:
                 rfid_id, _ = self.reader.read()
+                if self.is_repeat_read(rfid_id):
+                    continue
                 
-                conn = sqlite3.connect("attendance.db")
-                cursor = conn.cursor()
-                
-                cursor.execute("SELECT unique_id, name, course_name, course_code FROM lecturers WHERE rfid_id=?", (str(rfid_id),))
-                lecturer = cursor.fetchone()
+                role, record = self._rfid_index.get(str(rfid_id), (None, None))
                 
-                if lecturer:
+                if role == 'lecturer':
                     print("\nLecturer card detected. Starting new session...")
-                    lecturer_id, lecturer_name, course_name, course_code = lecturer
-                    conn.close()
+                    lecturer_id, lecturer_name, course_name, course_code = record
                     
                     # Lecturer feedback
                     self.both_leds_on()
@@ -361,60 +740,102 @@ class IntegratedAttendanceSystem:
                     print(f"New session created: {session_id}")
                     
                     self.persistent_rfid_attendance.update(self.new_rfid_attendance)
+                    # Taps made during verification are collected for the next session
+                    self.new_rfid_attendance = {}
                     
                     print("\nStarting face verification process...")
                     self.verify_attendance(self.persistent_rfid_attendance)
                     
-                    self.new_rfid_attendance = {}
                     self.both_leds_off()
                     
                     print("\nStarting new RFID attendance collection...")
                     continue
                 
-                cursor.execute("SELECT unique_id, name FROM students WHERE rfid_id=?", (str(rfid_id),))
-                student = cursor.fetchone()
-                
-                if not student:
+                if role != 'student':
                     print("Unregistered RFID card")
                     self.blink_led(RED_LED_PIN, 0.5)
-                    conn.close()
-                    continue
-                
-                unique_id, name = student
-                
-                if unique_id in self.persistent_rfid_attendance:
-                    print(f"RFID already registered for {name}. No need to tap again.")
-                    self.blink_led(RED_LED_PIN, 0.5)  # Red LED for duplicate
-                    conn.close()
-                    continue
-                
-                if unique_id in self.new_rfid_attendance:
-                    print(f"RFID already registered for {name} in current session.")
-                    self.blink_led(RED_LED_PIN, 0.5)  # Red LED for duplicate
-                    conn.close()
                     continue
                 
-                current_time = datetime.datetime.now().strftime('%H:%M:%S')
-                self.new_rfid_attendance[unique_id] = {
-                    'name': name,
-                    'rfid_time': current_time
-                }
-                
-                # Success feedback for new attendance
-                self.blink_led(YELLOW_LED_PIN, 0.5)
-                self.single_beep(0.1)
-                
-                print(f"New RFID registration for {name} at {current_time}")
-                print("Waiting for more new students or lecturer to start session verification...")
-                conn.close()
+                if self.record_student_tap(*record):
+                    print("Waiting for more new students or lecturer to start session verification...")
                 
+        except VisionWorkerError:
+            self.both_leds_off()
+            raise
         except Exception as e:
             logging.error(f"RFID attendance error: {e}")
             print(f"Error: {e}")
             self.both_leds_off()  # Ensure LEDs are off in case of error
 
+    def is_repeat_read(self, rfid_id):
+        """Check whether a read is the same card still resting on the reader"""
+        now = time.time()
+        repeat = rfid_id == self._last_rfid and now - self._last_rfid_time < RFID_REPEAT_WINDOW
+        self._last_rfid, self._last_rfid_time = rfid_id, now
+        return repeat
+
+    def record_student_tap(self, unique_id, name):
+        """Record a student's RFID tap, returning False for duplicates"""
+        if unique_id in self.persistent_rfid_attendance:
+            print(f"RFID already registered for {name}. No need to tap again.")
+            self.blink_led(RED_LED_PIN, 0.5)  # Red LED for duplicate
+            return False
+        
+        if unique_id in self.new_rfid_attendance:
+            print(f"RFID already registered for {name} in current session.")
+            self.blink_led(RED_LED_PIN, 0.5)  # Red LED for duplicate
+            return False
+        
+        current_time = datetime.datetime.now().strftime('%H:%M:%S')
+        self.new_rfid_attendance[unique_id] = {
+            'name': name,
+            'rfid_time': current_time
+        }
+        
+        # Success feedback for new attendance
+        self.blink_led(YELLOW_LED_PIN, 0.5)
+        self.single_beep(0.1)
+        
+        print(f"New RFID registration for {name} at {current_time}")
+        return True
+
+    def poll_rfid_tap(self):
+        """Handle a student tap without blocking, used while faces are being verified"""
+        rfid_id, _ = self.reader.read_no_block()
+        if rfid_id is None or self.is_repeat_read(rfid_id):
+            return
+        
+        role, record = self._rfid_index.get(str(rfid_id), (None, None))
+        if role == 'student':
+            self.record_student_tap(*record)
+        elif role == 'lecturer':
+            print("Face verification in progress. Lecturer card ignored.")
+        else:
+            print("Unregistered RFID card")
+            self.blink_led(RED_LED_PIN, 0.5)
+
+    def load_student_cache(self, unique_ids):
+        """Load RFID and face descriptors for students not yet cached"""
+        missing = [unique_id for unique_id in unique_ids if unique_id not in self._rfid_cache]
+        cursor = self.conn.cursor()
+        
+        for start in range(0, len(missing), SQL_IN_BATCH):
+            chunk = missing[start:start + SQL_IN_BATCH]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"""
+                SELECT unique_id, rfid_id, face_descriptors FROM students
+                WHERE unique_id IN ({placeholders})
+            """, chunk)
+            
+            for unique_id, rfid_id, stored_descriptors in cursor.fetchall():
+                self._rfid_cache[unique_id] = rfid_id
+                if stored_descriptors:
+                    self._descriptor_cache[unique_id] = np.frombuffer(
+                        stored_descriptors, dtype=np.float32).reshape(-1, 128)
+
     def verify_attendance(self, attendance_dict):
         """Mark final attendance using face recognition with LED/buzzer feedback"""
+        rows = []
         try:
             if not self.current_session:
                 print("No active session. Create a session first.")
@@ -423,42 +844,31 @@ class IntegratedAttendanceSystem:
             # Keep LEDs on during verification
             self.both_leds_on()
             
+            self.load_student_cache(attendance_dict)
+            
             for unique_id, data in attendance_dict.items():
                 name = data['name']
                 rfid_time = data['rfid_time']
                 
-                conn = sqlite3.connect("attendance.db")
-                cursor = conn.cursor()
-                cursor.execute("SELECT face_descriptors FROM students WHERE unique_id=?", (unique_id,))
-                stored_descriptors = cursor.fetchone()
-                
-                if not stored_descriptors:
+                face_descriptors = self._descriptor_cache.get(unique_id)
+                if face_descriptors is None:
                     print(f"No face descriptors found for {name}")
                     continue
                 
-                face_descriptors = np.frombuffer(stored_descriptors[0]).reshape(-1, 128)
-                
                 print(f"\nVerifying face for {name}...")
-                face_verified = self.verify_face(face_descriptors)
+                face_verified = self.request_face_verification(face_descriptors)
                 
                 current_time = datetime.datetime.now()
                 current_date = current_time.strftime('%Y-%m-%d')
                 status = 'present' if face_verified else 'partial'
                 
-                cursor.execute("""
-                    INSERT INTO attendance_log 
-                    (unique_id, name, date, session_id, rfid_time, face_time, status) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (unique_id, name, current_date, self.current_session, 
-                      rfid_time, 
-                      current_time.strftime('%H:%M:%S') if face_verified else None, 
-                      status))
+                rows.append((unique_id, name, current_date, self.current_session, 
+                             rfid_time, 
+                             current_time.strftime('%H:%M:%S') if face_verified else None, 
+                             status))
                 
-                conn.commit()
-                conn.close()
-                
-                # Log to Firebase
-                self.log_attendance_to_firebase(unique_id, name, status)
+                # Queue for Firebase
+                self.log_attendance_to_firebase(unique_id, name, status, self._rfid_cache.get(unique_id))
                 
                 # Feedback for face verification result
                 if face_verified:
@@ -469,88 +879,161 @@ class IntegratedAttendanceSystem:
                 
                 print(f"Final attendance marked for {name}: {status}")
             
+        except VisionWorkerError:
+            raise
         except Exception as e:
             logging.error(f"Face recognition attendance error: {e}")
             print(f"Error: {e}")
         finally:
+            # Keep whatever was verified before an error
+            if rows:
+                try:
+                    self.log_attendance_rows(rows)
+                except sqlite3.Error as e:
+                    logging.error(f"Attendance log write error: {e}")
+            self.flush_firebase_attendance()
+            self._vision_tasks.put(RELEASE_CAMERA)
             self.both_leds_off()
 
+    def log_attendance_rows(self, rows):
+        """Write a batch of attendance_log rows in a single transaction"""
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany("""
+                INSERT INTO attendance_log 
+                (unique_id, name, date, session_id, rfid_time, face_time, status) 
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
     def verify_face(self, stored_descriptors, threshold=0.6):
         """Verify face using stored descriptors"""
-        cap = cv2.VideoCapture(0)
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        if self._cap is None:
+            self._cap = self.open_camera()
+        cap = self._cap
+        
+        # Drop frames buffered since the previous student
+        for _ in range(CAMERA_FLUSH_FRAMES):
+            cap.grab()
+        
+        stored_mat = np.ascontiguousarray(stored_descriptors, dtype=np.float32)
+        # |s - f|^2 = |s|^2 - 2 s.f + |f|^2, so only one matrix-vector product per face
+        stored_norms = np.einsum('ij,ij->i', stored_mat, stored_mat)
+        thr2 = threshold * threshold
         
         face_verified = False
         start_time = time.time()
+        last_proc = 0
+        frame_idx = 0
+        consecutive_empty = 0
+        last_detected_gray = None
         exit_flag = False
         
-        while (time.time() - start_time) < 30 and not exit_flag:
-            ret, frame = cap.read()
+        while (time.time() - start_time) < 30 and not exit_flag and not self._stop_event.is_set():
+            # Grab every frame to keep the stream current, but only decode sampled ones
+            if not cap.grab():
+                print("Failed to capture frame. Retrying...")
+                time.sleep(0.1)
+                continue
+            
+            # Sample less often while nobody is in front of the camera, but keep grabbing
+            backoff = min(MAX_IDLE_BACKOFF, IDLE_BACKOFF_STEP * consecutive_empty)
+            if time.time() - last_proc <= FRAME_SAMPLE_INTERVAL + backoff:
+                continue
+            
+            ret, frame = cap.retrieve()
             if not ret:
                 print("Failed to capture frame. Retrying...")
                 time.sleep(0.1)
                 continue
+            last_proc = time.time()
             
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.detector(gray, 0)
+            small = self.downscale_frame(frame)
+            gray_small = small if small.ndim == 2 else cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            
+            # An empty scene that has not changed since the last detection cannot contain a new face
+            if (consecutive_empty and last_detected_gray is not None
+                    and not self.has_motion(last_detected_gray, gray_small)):
+                faces = []
+            else:
+                faces = self.detect_faces(frame, small)
+                last_detected_gray = gray_small
+            consecutive_empty = 0 if faces else consecutive_empty + 1
+            
+            # Only frames with a face need the full-colour image
+            bgr = self.frame_to_bgr(frame) if faces else None
             
             for face in faces:
-                shape = self.predictor(gray, face)
-                face_descriptor = self.face_reco_model.compute_face_descriptor(frame, shape)
-                
-                for stored_descriptor in stored_descriptors:
-                    distance = np.linalg.norm(stored_descriptor - face_descriptor)
-                    if distance < threshold:
-                        face_verified = True
-                        break
+                shape = self.predictor(bgr, face)
+                face_descriptor = self.face_reco_model.compute_face_descriptor(bgr, shape)
+                fd = np.asarray(face_descriptor, dtype=stored_mat.dtype)
                 
-                if face_verified:
+                # Squared L2 distance to every stored descriptor in one pass
+                d2 = stored_norms - 2 * (stored_mat @ fd) + fd @ fd
+                if d2.min() < thr2:
+                    face_verified = True
                     break
             
-            cv2.imshow('Face Verification', frame)
-            
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                exit_flag = True
-        
-        cap.release()
-        cv2.destroyAllWindows()
+            if self.show_preview and frame_idx % PREVIEW_EVERY_N_FRAMES == 0:
+                cv2.imshow('Face Verification', bgr if bgr is not None else self.frame_to_bgr(frame))
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    exit_flag = True
+            frame_idx += 1
         
         return face_verified
 
-    def log_attendance_to_firebase(self, unique_id, name, status):
-        """Log attendance to Firebase"""
+    def log_attendance_to_firebase(self, unique_id, name, status, rfid_id):
+        """Queue an attendance record for the next Firebase batch commit"""
         try:
-            conn = sqlite3.connect("attendance.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT rfid_id FROM students WHERE unique_id=?", (unique_id,))
-            rfid_result = cursor.fetchone()
-            conn.close()
-            
-            if not rfid_result:
+            if not rfid_id:
                 logging.error(f"RFID not found for student {name}")
                 return
                 
-            rfid_id = rfid_result[0]
             current_time = datetime.datetime.now()
             session_ref = self.db.collection('lectures').document(self.current_session)
             
             attendance_ref = session_ref.collection('attendance').document(str(rfid_id))
-            attendance_ref.set({
+            self._pending_firebase.append((attendance_ref, {
                 'unique_id': unique_id,
                 'rfid_id': str(rfid_id),
                 'name': name,
                 'date': current_time.strftime('%Y-%m-%d'),
                 'time': current_time.strftime('%H:%M:%S'),
                 'status': status
-            })
+            }))
+        except Exception as e:
+            logging.error(f"Firebase logging error: {e}")
+
+    def flush_firebase_attendance(self):
+        """Commit queued attendance records to Firebase in batched writes"""
+        pending, self._pending_firebase = self._pending_firebase, []
+        try:
+            for start in range(0, len(pending), FIREBASE_BATCH_LIMIT):
+                batch = self.db.batch()
+                for ref, payload in pending[start:start + FIREBASE_BATCH_LIMIT]:
+                    batch.set(ref, payload)
+                batch.commit()
         except Exception as e:
             logging.error(f"Firebase logging error: {e}")
 
     def cleanup(self):
-        """Cleanup GPIO pins"""
+        """Stop the feedback thread, cleanup GPIO pins and close the database connection"""
+        # The shared vision worker outlives this instance and is stopped at exit
+        # Drop pending pulses so the thread only finishes the one in progress before GPIO.cleanup()
+        while True:
+            try:
+                self._feedback_q.get_nowait()
+            except queue.Empty:
+                break
+        self._feedback_q.put(None)
+        self._feedback_thread.join()
         self.both_leds_off()
         GPIO.cleanup()
+        self.conn.close()
 
     def run(self):
         """Main menu system"""